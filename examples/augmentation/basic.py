@@ -24,7 +24,7 @@ class BatchgeneratorsTransform(tfm.Transform):
         # unsqueeze samples to add a batch dimensions, as required by batchgenerators
         for entry in self.entries:
             if entry not in sample:
-                if tfm.raise_error_if_entry_not_extracted:
+                if tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
                     raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
                 continue
 
@@ -55,7 +55,7 @@ class TorchIOTransform(tfm.Transform):
         # unsqueeze samples to be 4-D tensors, as required by TorchIO
         for entry in self.entries:
             if entry not in sample:
-                if tfm.raise_error_if_entry_not_extracted:
+                if tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
                     raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
                 continue
 
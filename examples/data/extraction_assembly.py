@@ -25,7 +25,7 @@ def main(hdf_file, is_meta):
 
     direct_extractor = extr.ComposeExtractor(
         [extr.ImagePropertiesExtractor(),
-         extr.DataExtractor(categories=(defs.KEY_LABELS, defs.KEY_IMAGES))]
+         extr.DataExtractor(categories=(defs.KEY_LABELS,))]
     )
     assembler = assm.SubjectAssembler(dataset)
 
@@ -0,0 +1,125 @@
+import argparse
+import queue
+import threading
+
+import torch.utils.data as torch_data
+import torch.nn as nn
+import torch
+
+import pymia.data.assembler as assm
+import pymia.data.transformation as tfm
+import pymia.data.definition as defs
+import pymia.data.extraction as extr
+import pymia.data.backends.pytorch as pymia_torch
+
+
+def main(hdf_file, is_meta):
+
+    if not is_meta:
+        extractor = extr.DataExtractor(categories=(defs.KEY_IMAGES,))
+    else:
+        extractor = extr.FilesystemDataExtractor(categories=(defs.KEY_IMAGES,))
+
+    transform = tfm.Permute(permutation=(2, 0, 1), entries=(defs.KEY_IMAGES,))
+
+    indexing_strategy = extr.SliceIndexing()
+    dataset = extr.PymiaDatasource(hdf_file, indexing_strategy, extractor, transform)
+
+    direct_extractor = extr.ComposeExtractor(
+        [extr.ImagePropertiesExtractor(),
+         extr.DataExtractor(categories=(defs.KEY_LABELS,))]
+    )
+    # the slices cover the entire subject, thus the assembled arrays do not need to be zero-initialized
+    assembler = assm.SubjectAssembler(dataset, zero_fn=assm.numpy_empty)
+
+    # torch specific handling
+    pytorch_dataset = pymia_torch.PytorchDatasetAdapter(dataset)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # background workers load the next batches, pinned memory (only useful with a GPU) allows asynchronous copies
+    loader = torch_data.dataloader.DataLoader(pytorch_dataset, batch_size=2, shuffle=False, num_workers=2,
+                                              pin_memory=torch.cuda.is_available(), persistent_workers=True,
+                                              prefetch_factor=2)
+    dummy_network = nn.Sequential(
+        nn.Conv2d(in_channels=2, out_channels=8, kernel_size=3, padding=1),
+        nn.Conv2d(in_channels=8, out_channels=1, kernel_size=3, padding=1),
+        nn.Sigmoid()
+    ).to(device)
+    torch.set_grad_enabled(False)
+
+    nb_batches = len(loader)
+
+    # the assembling runs in a background thread, which owns the assembler, while the next batches are predicted
+    assemble_queue = queue.Queue(maxsize=2)
+    assemble_errors = []
+
+    def assemble():
+        while True:
+            item = assemble_queue.get()
+            if item is None:
+                break
+            if assemble_errors:
+                continue  # keep draining the queue such that the prediction loop does not block
+            try:
+                numpy_prediction, sample_indices, is_last = item
+                assembler.add_batch(numpy_prediction, sample_indices, is_last)
+
+                for subject_index in assembler.subjects_ready:
+                    subject_prediction = assembler.get_assembled_subject(subject_index)
+
+                    direct_sample = dataset.direct_extract(direct_extractor, subject_index)
+                    target, image_properties = direct_sample[defs.KEY_LABELS], direct_sample[defs.KEY_PROPERTIES]
+
+                    # do_eval(subject_prediction, target)
+                    # do_save(subject_prediction, image_properties)
+            except Exception as e:
+                assemble_errors.append(e)
+
+    assemble_thread = threading.Thread(target=assemble)
+    assemble_thread.start()
+
+    try:
+        # looping over the data in the dataset
+        for i, batch in enumerate(loader):
+            if assemble_errors:
+                break  # no need to predict further batches
+
+            x, sample_indices = batch[defs.KEY_IMAGES], batch[defs.KEY_SAMPLE_INDEX]
+            x = x.to(device, non_blocking=True)
+            prediction = dummy_network(x)
+
+            numpy_prediction = prediction.cpu().numpy().transpose((0, 2, 3, 1))
+
+            is_last = i == nb_batches - 1
+            assemble_queue.put((numpy_prediction, sample_indices.numpy(), is_last))
+    finally:
+        # stop the assembling thread, also if the prediction failed
+        assemble_queue.put(None)
+        assemble_thread.join()
+
+    if assemble_errors:
+        raise assemble_errors[0]
+
+
+if __name__ == '__main__':
+    """The program's entry point.
+
+    Parse the arguments and run the program.
+    """
+
+    parser = argparse.ArgumentParser(description='Creation')
+
+    parser.add_argument(
+        '--hdf_file',
+        type=str,
+        default='../example-data/example-dataset.h5',
+        help='Path to the dataset file.'
+    )
+
+    parser.add_argument(
+        '--meta',
+        action='store_true',
+        help='Extract the data from the raw files. Use this option if the hdf_file is a metadata dataset.'
+    )
+
+    args = parser.parse_args()
+    main(args.hdf_file, args.meta)
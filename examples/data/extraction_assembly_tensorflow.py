@@ -22,7 +22,7 @@ def main(hdf_file):
 
     direct_extractor = extr.ComposeExtractor(
         [extr.ImagePropertiesExtractor(),
-         extr.DataExtractor(categories=(defs.KEY_LABELS, defs.KEY_IMAGES))]
+         extr.DataExtractor(categories=(defs.KEY_LABELS,))]
     )
     assembler = assm.SubjectAssembler(dataset)
 
@@ -1,9 +1,12 @@
 import abc
+import copy
+import tempfile
 import typing
 
 import numpy as np
 
 import pymia.data.definition as defs
+import pymia.data.indexexpression as expr
 import pymia.data.transformation as tfm
 import pymia.data.extraction as extr
 
@@ -40,8 +43,36 @@ class Assembler(abc.ABC):
         pass
 
 
-def numpy_zeros(shape: tuple, assembling_key: str, subject_index: int):
-    return np.zeros(shape)
+def numpy_zeros(shape: tuple, assembling_key: str, subject_index: int, dtype=np.float64):
+    """Initializes the array holding the predictions with zeros.
+
+    A smaller data type reduces the memory and the memory traffic of the assembling, e.g.
+    :code:`functools.partial(numpy_zeros, dtype=np.float16)`. The predictions are cast to the data type when assembled,
+    thus precision is lost. Integer types truncate, i.e. scale the predictions before assembling (e.g., probabilities
+    multiplied by 255 for :code:`np.uint8`) and divide the assembled subject to restore the approximate values.
+    """
+    return np.zeros(shape, dtype=dtype)
+
+
+def numpy_empty(shape: tuple, assembling_key: str, subject_index: int, dtype=np.float64):
+    """Initializes the array holding the predictions without setting its values.
+
+    Avoids writing the entire array twice (initialization and assembling) but must only be used if the samples cover the
+    entire subject (e.g., :class:`.SliceIndexing`). Otherwise, the array is left with arbitrary values where no sample
+    was assembled. See :func:`numpy_zeros` regarding the data type.
+    """
+    return np.empty(shape, dtype=dtype)
+
+
+def memmap_zeros(shape: tuple, assembling_key: str, subject_index: int, dtype=np.float64):
+    """Initializes the array holding the predictions as memory-map to a temporary file.
+
+    The assembled data is backed by the file instead of the memory, which allows assembling subjects that do not
+    comfortably fit into the memory. The temporary file is removed when the array is no longer referenced.
+    Use :code:`np.array` (or :code:`.copy()`) on the assembled subject to load it into memory, whereas
+    :code:`np.asarray` returns a view that is still backed by the file. See :func:`numpy_zeros` regarding the data type.
+    """
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
 
 
 class SubjectAssembler(Assembler):
@@ -58,6 +89,9 @@ class SubjectAssembler(Assembler):
             zero_fn: A function that initializes the numpy array to hold the predictions.
                 Args: shape: tuple with the shape of the subject's labels.
                 Returns: A np.ndarray
+                Use :func:`numpy_empty` to skip the initialization if the samples cover the entire subject or
+                :func:`memmap_zeros` to assemble the predictions in temporary files instead of the memory. The data type
+                can be set by :func:`functools.partial`, e.g. :code:`partial(numpy_zeros, dtype=np.float16)`.
             assemble_interaction_fn (callable, optional): A `callable` that may modify the sample and indexing before adding
                 the data to the assembled array. This enables handling special cases. Must follow the
                 :code:`.AssembleInteractionFn.__call__` interface. By default neither data nor indexing is modified.
@@ -65,47 +99,111 @@ class SubjectAssembler(Assembler):
         self.datasource = datasource
         self.zero_fn = zero_fn
         self.assemble_interaction_fn = assemble_interaction_fn
-        self._subjects_ready = set()
+        self._single_prediction = False  # whether the predictions are not provided as dict
+        self._ready_bits = bytearray()  # one entry per subject index, non-zero if the subject is ready
+        self._nb_ready = 0
+        self._current_subject = None
         self.predictions = {}
 
     @property
     def subjects_ready(self):
         """see :meth:`Assembler.subjects_ready`"""
-        return self._subjects_ready.copy()
+        if not self._nb_ready:
+            return set()
+        return set(np.flatnonzero(np.frombuffer(self._ready_bits, dtype=np.uint8)).tolist())
 
     def add_batch(self, to_assemble: typing.Union[np.ndarray, typing.Dict[str, np.ndarray]], sample_indices: np.ndarray,
                   last_batch=False, **kwargs):
         """see :meth:`Assembler.add_batch`"""
-        if not isinstance(to_assemble, dict):
+        self._single_prediction = not isinstance(to_assemble, dict)
+        if self._single_prediction:
             to_assemble = {'__prediction': to_assemble}
 
         sample_indices = sample_indices.tolist()  # to ensure that not np.int64 entries, but int
-
-        for batch_idx, sample_idx in enumerate(sample_indices):
-            self.add_sample(to_assemble, batch_idx, sample_idx)
+        indices = [self.datasource.indices[sample_idx] for sample_idx in sample_indices]
+
+        # initialize all subjects of the batch before adding the samples
+        for subject_index, _ in indices:
+            self._prepare_subject(to_assemble, subject_index)
+
+        predictions = self.predictions
+        interaction_fn = self.assemble_interaction_fn
+        items = to_assemble.items()
+        if interaction_fn is None:
+            # direct path, neither data nor indexing is modified
+            for subject_index, expression, batch_selection, axis in self._get_runs(indices):
+                subject_prediction = predictions[subject_index]
+                for key, batch_data in items:
+                    data = batch_data[batch_selection]
+                    if axis:  # the batch dimension of a block becomes the sliced axis
+                        data = np.moveaxis(data, 0, axis)
+                    subject_prediction[key][expression] = data
+        else:
+            for batch_idx, (subject_index, index_expression) in enumerate(indices):
+                subject_prediction = predictions[subject_index]
+                for key, batch_data in items:
+                    data, key_index_expression = interaction_fn(key, batch_data[batch_idx], index_expression)
+                    subject_prediction[key][key_index_expression.expression] = data
 
         if last_batch:
             # to prevent from last batch to be ignored
             self.end()
 
     def end(self):
-        self._subjects_ready = set(self.predictions.keys())
+        for subject_index in self.predictions:
+            self._mark_ready(subject_index)
+
+    def _mark_ready(self, subject_index: int):
+        if subject_index >= len(self._ready_bits):
+            self._ready_bits.extend(bytes(subject_index + 1 - len(self._ready_bits)))
+        if not self._ready_bits[subject_index]:
+            self._ready_bits[subject_index] = 1
+            self._nb_ready += 1
+
+    def _unmark_ready(self, subject_index: int) -> bool:
+        if subject_index >= len(self._ready_bits) or not self._ready_bits[subject_index]:
+            return False
+        self._ready_bits[subject_index] = 0
+        self._nb_ready -= 1
+        return True
+
+    def add_sample(self, to_assemble, batch_idx, sample_idx, subject_index: int = None,
+                   index_expression: expr.IndexExpression = None):
+        """Add a single sample of the batch to be assembled.
 
-    def add_sample(self, to_assemble, batch_idx, sample_idx):
-        subject_index, index_expression = self.datasource.indices[sample_idx]
+        Args:
+            to_assemble (dict): Dictionary of the batch data to be assembled.
+            batch_idx (int): Index of the sample in the batch.
+            sample_idx (int): Index of the sample in the datasource.
+            subject_index (int): The subject index of the sample if already resolved by the caller.
+            index_expression (.IndexExpression): The index expression of the sample if already resolved by the caller.
+                The sample is looked up in the datasource if either :code:`subject_index` or :code:`index_expression`
+                is None.
+        """
+        if subject_index is None or index_expression is None:
+            subject_index, index_expression = self.datasource.indices[sample_idx]
 
-        # initialize subject
-        if subject_index not in self.predictions and not self.predictions:  # fist subject
-            self.predictions[subject_index] = self._init_new_subject(to_assemble, subject_index)
-        elif subject_index not in self.predictions:  # new subject
-            self._subjects_ready = set(self.predictions.keys())
-            self.predictions[subject_index] = self._init_new_subject(to_assemble, subject_index)
+        self._prepare_subject(to_assemble, subject_index)
+
+        subject_prediction = self.predictions[subject_index]
+        if self.assemble_interaction_fn is None:
+            for key in to_assemble:
+                subject_prediction[key][index_expression.expression] = to_assemble[key][batch_idx]
+            return
 
         for key in to_assemble:
-            data = to_assemble[key][batch_idx]
-            if self.assemble_interaction_fn:
-                data, index_expression = self.assemble_interaction_fn(key, data, index_expression)
-            self.predictions[subject_index][key][index_expression.expression] = data
+            data, key_index_expression = self.assemble_interaction_fn(key, to_assemble[key][batch_idx], index_expression)
+            subject_prediction[key][key_index_expression.expression] = data
+
+    def _prepare_subject(self, to_assemble, subject_index):
+        if subject_index in self.predictions:
+            return
+
+        # new subject, i.e. the previous subject is finished (if not already retrieved)
+        if self._current_subject in self.predictions:
+            self._mark_ready(self._current_subject)
+        self._current_subject = subject_index
+        self.predictions[subject_index] = self._init_new_subject(to_assemble, subject_index)
 
     def _init_new_subject(self, to_assemble, subject_index):
         subject_prediction = {}
@@ -119,21 +217,119 @@ class SubjectAssembler(Assembler):
 
     def get_assembled_subject(self, subject_index: int):
         """see :meth:`Assembler.get_assembled_subject`"""
-        try:
-            self._subjects_ready.remove(subject_index)
-        except KeyError:
-            # check if subject is assembled but not listed as ready
-            # this can happen if only one subject was assembled or last
-            if subject_index not in self.predictions:
-                raise ValueError('Subject with index {} not in assembler'.format(subject_index))
-        assembled = self.predictions.pop(subject_index)
-        if '__prediction' in assembled:
+        assembled = self.peek_assembled_subject(subject_index)
+        self.release_subject(subject_index)
+        return assembled
+
+    def peek_assembled_subject(self, subject_index: int):
+        """Get the assembled data of a subject without removing the subject from the assembler.
+
+        The assembled arrays are not copied. Call :meth:`release_subject` once the data is consumed (e.g., evaluated and
+        saved) such that the assembler does not keep the arrays alive.
+
+        Args:
+            subject_index (int): Index of the assembled subject to be retrieved.
+
+        Returns:
+            object: The assembled data of the subject (might be multiple arrays).
+        """
+        # a subject might be assembled but not listed as ready
+        # this can happen if only one subject was assembled or last
+        if subject_index not in self.predictions:
+            raise ValueError('Subject with index {} not in assembler'.format(subject_index))
+        assembled = self.predictions[subject_index]
+        if self._single_prediction:
             return assembled['__prediction']
         return assembled
 
+    def release_subject(self, subject_index: int):
+        """Remove a subject from the assembler, i.e. from the assembled and ready subjects.
+
+        Args:
+            subject_index (int): Index of the assembled subject to be removed.
+        """
+        if subject_index not in self.predictions:
+            raise ValueError('Subject with index {} not in assembler'.format(subject_index))
+        self._unmark_ready(subject_index)
+        del self.predictions[subject_index]
+
+    @staticmethod
+    def _get_runs(indices):
+        """Groups consecutive samples of a subject that are slices along the same axis.
+
+        Args:
+            indices (list): The (subject_index, index_expression) tuples of the batch.
+
+        Returns:
+            list: Tuples (subject_index, expression, batch_selection, axis). Samples that can not be grouped keep their
+            expression, :code:`batch_selection` is their batch index and :code:`axis` is None. Groups of slices are
+            written as one block, where :code:`batch_selection` is a slice of the batch and :code:`axis` the sliced axis.
+            The slices of a group are selected by a slice if they are adjacent and by an index array otherwise.
+        """
+        runs = []
+        # subject_index, axis, slice indices, first batch index
+        current = None
+
+        def close_run():
+            subject_index, axis, slice_indices, batch_start = current
+            length = len(slice_indices)
+            if length == 1:
+                runs.append((subject_index, indices[batch_start][1].expression, batch_start, None))
+                return
+
+            if slice_indices == list(range(slice_indices[0], slice_indices[0] + length)):
+                selection = slice(slice_indices[0], slice_indices[0] + length)
+            else:
+                selection = np.array(slice_indices)
+            expression = (slice(None),) * axis + (selection,)
+            runs.append((subject_index, expression, slice(batch_start, batch_start + length), axis))
+
+        for batch_idx, (subject_index, index_expression) in enumerate(indices):
+            position = SubjectAssembler._get_slice_position(index_expression.expression)
+            # repeated slices are not grouped to keep the order of the writes
+            if current is not None and position is not None and current[0] == subject_index and \
+                    current[1] == position[0] and position[1] not in current[2]:
+                current[2].append(position[1])
+                continue
+
+            if current is not None:
+                close_run()
+                current = None
+
+            if position is None:
+                runs.append((subject_index, index_expression.expression, batch_idx, None))
+            else:
+                current = [subject_index, position[0], [position[1]], batch_idx]
+
+        if current is not None:
+            close_run()
+        return runs
+
+    @staticmethod
+    def _get_slice_position(expression):
+        """Returns the tuple (axis, index) if the expression selects one slice along an axis and None otherwise."""
+        if not isinstance(expression, tuple):
+            return None
+
+        position = None
+        for axis, entry in enumerate(expression):
+            if isinstance(entry, int):
+                if position is not None:
+                    return None
+                position = (axis, entry)
+            elif entry != slice(None):
+                return None
+        return position
+
 
 def mean_merge_fn(planes: list):
-    return np.stack(planes).mean(axis=0)
+    # accumulate the planes instead of stacking them, which would require a copy of all planes at once
+    dtype = planes[0].dtype if np.issubdtype(planes[0].dtype, np.floating) else np.float64
+    merged = np.array(planes[0], dtype=dtype)  # plain ndarray, also for memory-mapped planes
+    for plane in planes[1:]:
+        merged += plane
+    merged /= len(planes)
+    return merged
 
 
 class AssembleInteractionFn:
@@ -163,16 +359,27 @@ class AssembleInteractionFn:
 class ApplyTransformInteractionFn(AssembleInteractionFn):
 
     def __init__(self, transform: tfm.Transform) -> None:
-        self.transform = transform
+        """Applies a transform to the data and the index expression.
+
+        Args:
+            transform (.Transform): The transform. Only the entry being assembled is passed to the transform, thus a
+                (shallow) copy of the transform is configured to not raise an error for its other entries. The given
+                transform is not modified.
+        """
+        self.transform = self._copy_not_raising(transform)
 
     def __call__(self, key, data, index_expr, **kwargs):
-        temp = tfm.raise_error_if_entry_not_extracted
-        tfm.raise_error_entry_not_extracted = False
         ret = self.transform({key: data, defs.KEY_INDEX_EXPR: index_expr})
-        tfm.raise_error_entry_not_extracted = temp
-
         return ret[key], ret[defs.KEY_INDEX_EXPR]
 
+    @staticmethod
+    def _copy_not_raising(transform: tfm.Transform) -> tfm.Transform:
+        transform = copy.copy(transform)
+        if isinstance(transform, tfm.ComposeTransform):
+            transform.transforms = [ApplyTransformInteractionFn._copy_not_raising(t) for t in transform.transforms]
+        transform.raise_if_missing = False
+        return transform
+
 
 class PlaneSubjectAssembler(Assembler):
 
@@ -196,8 +403,12 @@ class PlaneSubjectAssembler(Assembler):
                 Returns: A np.ndarray
         """
         self.datasource = datasource
-        self.planes = {}  # type: typing.Dict[int, SubjectAssembler]
+        self.planes = [None, None, None]  # type: typing.List[typing.Optional[SubjectAssembler]]
         self._subjects_ready = set()
+        self._single_prediction = False  # whether the predictions are not provided as dict
+        self._interaction_fns = {}  # type: typing.Dict[tuple, ApplyTransformInteractionFn]
+        self._plane_dimensions = {}  # type: typing.Dict[int, typing.Tuple[expr.IndexExpression, int]]
+        self._subject_shapes = {}  # type: typing.Dict[int, tuple]
         self.zero_fn = zero_fn
         self.merge_fn = merge_fn
 
@@ -210,41 +421,45 @@ class PlaneSubjectAssembler(Assembler):
                   last_batch=False, **kwargs):
         """see :meth:`Assembler.add_batch`"""
 
-        if not isinstance(to_assemble, dict):
+        self._single_prediction = not isinstance(to_assemble, dict)
+        if self._single_prediction:
             to_assemble = {'__prediction': to_assemble}
 
         sample_indices = sample_indices.tolist()  # to ensure that not np.int64 entries, but int
+        shape_extractor = extr.ImagePropertyShapeExtractor(numpy_format=True)
+        keys = tuple(to_assemble.keys())
 
         for batch_idx, sample_idx in enumerate(sample_indices):
             subject_index, index_expression = self.datasource.indices[sample_idx]
 
-            plane_dimension = self._get_plane_dimension(index_expression)
+            plane_dimension = self._get_cached_plane_dimension(index_expression)
 
-            if plane_dimension not in self.planes:
-                self.planes[plane_dimension] = SubjectAssembler(self.datasource, self.zero_fn)
+            plane_assembler = self.planes[plane_dimension]
+            if plane_assembler is None:
+                plane_assembler = self.planes[plane_dimension] = SubjectAssembler(self.datasource, self.zero_fn)
 
-            indexing = index_expression.get_indexing()
-            if not isinstance(indexing, list):
-                indexing = [indexing]
+            subject_shape = self._subject_shapes.get(subject_index)
+            if subject_shape is None:
+                subject_shape = self.datasource.direct_extract(shape_extractor, subject_index)[defs.KEY_SHAPE]
+                self._subject_shapes[subject_index] = subject_shape
 
-            extractor = extr.ImagePropertyShapeExtractor(numpy_format=True)
-            required_plane_shape = self.datasource.direct_extract(extractor, subject_index)[defs.KEY_SHAPE]
-
-            index_at_plane = indexing[plane_dimension]
-            if isinstance(index_at_plane, tuple):
-                # is a range in the off plane direction (tuple)
-                required_off_plane_size = index_at_plane[1] - index_at_plane[0]
-                required_plane_shape[plane_dimension] = required_off_plane_size
+            index_at_plane = index_expression.expression[plane_dimension]
+            if isinstance(index_at_plane, slice):
+                # is a range in the off plane direction
+                required_off_plane_size = index_at_plane.stop - index_at_plane.start
+                required_plane_shape = \
+                    subject_shape[:plane_dimension] + (required_off_plane_size,) + subject_shape[plane_dimension + 1:]
             else:  # isinstance of int
-                # is one slice in off plane direction (int)
-                required_plane_shape.pop(plane_dimension)
-            transform = tfm.SizeCorrection(tuple(required_plane_shape), entries=tuple(to_assemble.keys()))
-            self.planes[plane_dimension].assemble_interaction_fn = ApplyTransformInteractionFn(transform)
+                # is one slice in off plane direction
+                required_plane_shape = subject_shape[:plane_dimension] + subject_shape[plane_dimension + 1:]
+            plane_assembler.assemble_interaction_fn = self._get_interaction_fn(plane_dimension, required_plane_shape, keys)
 
-            self.planes[plane_dimension].add_sample(to_assemble, batch_idx, sample_idx)
+            plane_assembler.add_sample(to_assemble, batch_idx, sample_idx, subject_index, index_expression)
 
         ready = None
-        for plane_assembler in self.planes.values():
+        for plane_assembler in self.planes:
+            if plane_assembler is None:
+                continue
             if last_batch:
                 plane_assembler.end()
 
@@ -256,16 +471,18 @@ class PlaneSubjectAssembler(Assembler):
 
     def get_assembled_subject(self, subject_index: int):
         """see :meth:`Assembler.get_assembled_subject`"""
+        planes = [plane for plane in self.planes if plane is not None]
         try:
             self._subjects_ready.remove(subject_index)
         except KeyError:
             # check if subject is assembled but not listed as ready
             # this can happen if only one subject was assembled or last
-            if subject_index not in self.planes[0].predictions:
+            if not planes or subject_index not in planes[0].predictions:
                 raise ValueError('Subject with index {} not in assembler'.format(subject_index))
+        self._subject_shapes.pop(subject_index, None)
 
         assembled = {}
-        for plane in self.planes.values():
+        for plane in planes:
             ret_val = plane.get_assembled_subject(subject_index)
             if not isinstance(ret_val, dict):
                 ret_val = {'__prediction': ret_val}
@@ -275,10 +492,27 @@ class PlaneSubjectAssembler(Assembler):
         for key in assembled:
             assembled[key] = self.merge_fn(assembled[key])
 
-        if '__prediction' in assembled:
+        if self._single_prediction:
             return assembled['__prediction']
         return assembled
 
+    def _get_interaction_fn(self, plane_dimension: int, required_plane_shape: tuple, keys: tuple):
+        # samples typically share a few shapes only, thus reuse the size correction for equal shapes
+        cache_key = (plane_dimension, required_plane_shape, keys)
+        interaction_fn = self._interaction_fns.get(cache_key)
+        if interaction_fn is None:
+            transform = tfm.SizeCorrection(required_plane_shape, entries=keys)
+            interaction_fn = self._interaction_fns[cache_key] = ApplyTransformInteractionFn(transform)
+        return interaction_fn
+
+    def _get_cached_plane_dimension(self, index_expr):
+        # the index expressions are shared among the subjects (and samples) of the datasource, thus cache by identity.
+        # the expression is kept with the dimension such that a reused id is not mistaken for a cached expression
+        cached = self._plane_dimensions.get(id(index_expr))
+        if cached is None or cached[0] is not index_expr:
+            cached = self._plane_dimensions[id(index_expr)] = (index_expr, self._get_plane_dimension(index_expr))
+        return cached[1]
+
     @staticmethod
     def _get_plane_dimension(index_expr):
         for i, entry in enumerate(index_expr.expression):
@@ -302,6 +536,7 @@ class Subject2dAssembler(Assembler):
         super().__init__()
         self.datasource = datasource
         self._subjects_ready = set()
+        self._single_prediction = False  # whether the predictions are not provided as dict
         self.predictions = {}
 
     @property
@@ -313,7 +548,8 @@ class Subject2dAssembler(Assembler):
                   last_batch=False, **kwargs):
         """see :meth:`Assembler.add_batch`"""
 
-        if not isinstance(to_assemble, dict):
+        self._single_prediction = not isinstance(to_assemble, dict)
+        if self._single_prediction:
             to_assemble = {'__prediction': to_assemble}
 
         sample_indices = sample_indices.tolist()  # to ensure that not np.int64 entries, but int
@@ -335,6 +571,6 @@ class Subject2dAssembler(Assembler):
             if subject_index not in self.predictions:
                 raise ValueError('Subject with index {} not in assembler'.format(subject_index))
         assembled = self.predictions.pop(subject_index)
-        if '__prediction' in assembled:
+        if self._single_prediction:
             return assembled['__prediction']
         return assembled
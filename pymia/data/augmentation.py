@@ -75,12 +75,15 @@ class RandomCrop(tfm.Transform):
             return sample
 
         for entry in self.entries:
-            if entry not in sample:
+            if entry not in sample and tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
                 raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+        entries = [entry for entry in self.entries if entry in sample]
+        if not entries:
+            return sample
 
-        anchors = [np.random.randint(0, sample[self.entries[0]].shape[a] - s) for a, s in zip(self.axis, self.shape)]
+        anchors = [np.random.randint(0, sample[entries[0]].shape[a] - s) for a, s in zip(self.axis, self.shape)]
 
-        for entry in self.entries:
+        for entry in entries:
             # todo(fabianbalsiger): replace by slicing (more elegant and faster?)
             for axis, new_axis_size, anchor in zip(self.axis, self.shape, anchors):
                 sample[entry] = np.take(sample[entry], range(anchor, anchor + new_axis_size), axis)
@@ -129,11 +132,14 @@ class RandomElasticDeformation(tfm.Transform):
             return sample
 
         for entry in self.entries:
-            if entry not in sample:
+            if entry not in sample and tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
                 raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+        entries = [entry for entry in self.entries if entry in sample]
+        if not entries:
+            return sample
 
         # initialize a SimpleITK image
-        shape = sample[self.entries[0]].shape[:self.spatial_rank]
+        shape = sample[entries[0]].shape[:self.spatial_rank]
         img = sitk.GetImageFromArray(np.zeros(shape))  # todo(fabianbalsiger): set spacing etc with ImagePropertiesExtractor?
 
         # initialize B-spline transformation
@@ -150,6 +156,8 @@ class RandomElasticDeformation(tfm.Transform):
         bspline_transformation.SetParameters(tuple(params))
 
         for interpolator_idx, entry in enumerate(self.entries):
+            if entry not in sample:
+                continue
             data = sample[entry]
             for channel in range(data.shape[-1]):
                 img = sitk.GetImageFromArray(data[..., channel])
@@ -186,7 +194,9 @@ class RandomMirror(tfm.Transform):
 
         for entry in self.entries:
             if entry not in sample:
-                raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+                if tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
+                    raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+                continue
 
             sample[entry] = np.flip(sample[entry], self.axis).copy()
 
@@ -223,7 +233,9 @@ class RandomRotation90(tfm.Transform):
 
         for entry in self.entries:
             if entry not in sample:
-                raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+                if tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
+                    raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+                continue
 
             if sample[entry].shape[self.axes[0]] != sample[entry].shape[self.axes[1]]:
                 warnings.warn(f'entry "{entry}" has unequal in-plane dimensions ({sample[entry].shape[self.axes[0]]}, '
@@ -283,13 +295,16 @@ class RandomShift(tfm.Transform):
             return sample
 
         for entry in self.entries:
-            if entry not in sample:
+            if entry not in sample and tfm.raise_error_if_entry_not_extracted and self.raise_if_missing:
                 raise ValueError(tfm.ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
+        entries = [entry for entry in self.entries if entry in sample]
+        if not entries:
+            return sample
 
-        shifts_maximums = [int(s * sample[self.entries[0]].shape[a]) for a, s in zip(self.axis, self.shift)]
+        shifts_maximums = [int(s * sample[entries[0]].shape[a]) for a, s in zip(self.axis, self.shift)]
         shifts = [np.random.randint(-s_max, s_max) if s_max != 0 else 0 for s_max in shifts_maximums]
 
-        for entry in self.entries:
+        for entry in entries:
             for axis, shift in zip(self.axis, shifts):
                 sample[entry] = np.roll(sample[entry], shift, axis)
                 # todo(fabianbalsiger): implement zero filling (as optional "mode" parameter)?
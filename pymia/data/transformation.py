@@ -13,6 +13,11 @@ raise_error_if_entry_not_extracted = True
 
 # follows the principle of torchvision transform
 class Transform(abc.ABC):
+
+    raise_if_missing = True
+    """bool: Whether to raise an error if an entry to transform is not in the sample. Has no effect if the module-level
+    :code:`raise_error_if_entry_not_extracted` is False."""
+
     @abc.abstractmethod
     def __call__(self, sample: dict) -> dict:
         pass
@@ -23,6 +28,15 @@ class ComposeTransform(Transform):
     def __init__(self, transforms: typing.Iterable[Transform]) -> None:
         self.transforms = transforms
 
+    @property
+    def raise_if_missing(self):
+        return all(t.raise_if_missing for t in self.transforms)
+
+    @raise_if_missing.setter
+    def raise_if_missing(self, value: bool):
+        for t in self.transforms:
+            t.raise_if_missing = value
+
     def __call__(self, sample: dict) -> dict:
         for t in self.transforms:
             sample = t(sample)
@@ -37,10 +51,10 @@ class LoopEntryTransform(Transform, abc.ABC):
         self.entries = entries
 
     @staticmethod
-    def loop_entries(sample: dict, fn, entries, loop_axis=None):
+    def loop_entries(sample: dict, fn, entries, loop_axis=None, raise_if_missing=True):
         for entry in entries:
             if entry not in sample:
-                if raise_error_if_entry_not_extracted:
+                if raise_error_if_entry_not_extracted and raise_if_missing:
                     raise ValueError(ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
                 continue
 
@@ -57,7 +71,7 @@ class LoopEntryTransform(Transform, abc.ABC):
         return sample
 
     def __call__(self, sample: dict) -> dict:
-        return self.loop_entries(sample, self.transform_entry, self.entries, self.loop_axis)
+        return self.loop_entries(sample, self.transform_entry, self.entries, self.loop_axis, self.raise_if_missing)
 
     @abc.abstractmethod
     def transform_entry(self, np_entry, entry, loop_i=None) -> np.ndarray:
@@ -213,7 +227,7 @@ class SizeCorrection(Transform):
     def __call__(self, sample: dict) -> dict:
         for entry in self.entries:
             if entry not in sample:
-                if raise_error_if_entry_not_extracted:
+                if raise_error_if_entry_not_extracted and self.raise_if_missing:
                     raise ValueError(ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
                 continue
 
@@ -258,7 +272,7 @@ class Mask(Transform):
 
         for entry in self.entries:
             if entry not in sample:
-                if raise_error_if_entry_not_extracted:
+                if raise_error_if_entry_not_extracted and self.raise_if_missing:
                     raise ValueError(ENTRY_NOT_EXTRACTED_ERR_MSG.format(entry))
                 continue
 
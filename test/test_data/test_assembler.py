@@ -0,0 +1,367 @@
+import functools
+import unittest
+
+import numpy as np
+
+import pymia.data.assembler as assm
+import pymia.data.augmentation as augm
+import pymia.data.definition as defs
+import pymia.data.extraction as extr
+import pymia.data.indexexpression as expr
+import pymia.data.transformation as tfm
+
+
+class _Datasource:
+    """Minimal stand-in for :class:`.PymiaDatasource` providing the indices and the subject shapes."""
+
+    def __init__(self, shapes, indexing_strategy):
+        self.shapes = shapes
+        self.indices = []
+        for subject_index, shape in enumerate(shapes):
+            self.indices.extend((subject_index, index_expr) for index_expr in indexing_strategy(shape))
+
+    def direct_extract(self, extractor, subject_index, transform=None):
+        return {defs.KEY_SHAPE: self.shapes[subject_index]}
+
+
+def _per_sample_interaction_fn(key, data, index_expr, **kwargs):
+    # any interaction function disables the block writes, i.e. every sample is written separately
+    return data, index_expr
+
+
+def _assemble(assembler, predictions, order, batch_size):
+    assembled = {}
+    nb_batches = (len(order) + batch_size - 1) // batch_size
+    for i in range(nb_batches):
+        sample_indices = order[i * batch_size:(i + 1) * batch_size]
+        if isinstance(predictions, dict):
+            batch = {key: value[sample_indices] for key, value in predictions.items()}
+        else:
+            batch = predictions[sample_indices]
+        assembler.add_batch(batch, sample_indices, i == nb_batches - 1)
+        for subject_index in assembler.subjects_ready:
+            assembled[subject_index] = assembler.get_assembled_subject(subject_index)
+    return assembled
+
+
+def _get_predictions(datasource, volumes):
+    return np.stack([volumes[subject_index][index_expr.expression] for subject_index, index_expr in datasource.indices])
+
+
+class TestSubjectAssembler(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def assert_assembled_equal(self, expected, actual):
+        self.assertEqual(expected.keys(), actual.keys())
+        for subject_index in expected:
+            expected_subject, actual_subject = expected[subject_index], actual[subject_index]
+            if isinstance(expected_subject, dict):
+                self.assertEqual(expected_subject.keys(), actual_subject.keys())
+                for key in expected_subject:
+                    np.testing.assert_array_equal(actual_subject[key], expected_subject[key])
+            else:
+                np.testing.assert_array_equal(actual_subject, expected_subject)
+
+    def assert_block_equals_per_sample(self, datasource, predictions, order, batch_size):
+        expected = _assemble(assm.SubjectAssembler(datasource, assemble_interaction_fn=_per_sample_interaction_fn),
+                             predictions, order, batch_size)
+        actual = _assemble(assm.SubjectAssembler(datasource), predictions, order, batch_size)
+        self.assert_assembled_equal(expected, actual)
+
+    def check_indexing(self, shapes, indexing_strategy):
+        datasource = _Datasource(shapes, indexing_strategy)
+        volumes = [self.rng.random(shape + (2,)) for shape in shapes]
+        predictions = _get_predictions(datasource, volumes)
+        dict_predictions = {'a': predictions, 'b': predictions[..., :1] * 2}
+
+        nb_samples = len(datasource.indices)
+        subject_indices = np.array([subject_index for subject_index, _ in datasource.indices])
+        # shuffled within the subjects, the subjects themselves are in order
+        shuffled_per_subject = np.concatenate([self.rng.permutation(np.flatnonzero(subject_indices == subject_index))
+                                               for subject_index in range(len(shapes))])
+        for order in (np.arange(nb_samples), shuffled_per_subject, self.rng.permutation(nb_samples)):
+            for batch_size in range(1, 9):
+                with self.subTest(order=order, batch_size=batch_size):
+                    self.assert_block_equals_per_sample(datasource, predictions, order, batch_size)
+                    self.assert_block_equals_per_sample(datasource, dict_predictions, order, batch_size)
+
+        # subjects are released when the next subject starts, thus the volumes are only recovered for ordered subjects
+        for order in (np.arange(nb_samples), shuffled_per_subject):
+            for batch_size in range(1, 9):
+                with self.subTest(order=order, batch_size=batch_size):
+                    assembled = _assemble(assm.SubjectAssembler(datasource), predictions, order, batch_size)
+                    self.assert_assembled_equal(dict(enumerate(volumes)), assembled)
+
+    def test_slice_indexing(self):
+        for axis in (0, 1, 2):
+            # the subjects only differ in the size of the sliced axis such that all slices can be stacked to a batch
+            shape = [4, 5, 6]
+            other_shape = list(shape)
+            other_shape[axis] -= 1
+            with self.subTest(axis=axis):
+                self.check_indexing([tuple(shape), tuple(other_shape)], extr.SliceIndexing(axis))
+
+    def test_slice_indexing_multiple_axes(self):
+        # equal sizes in all dimensions such that the slices of all axes can be stacked to a batch
+        self.check_indexing([(4, 4, 4), (4, 4, 4)], extr.SliceIndexing((0, 1, 2)))
+
+    def test_patch_wise_indexing(self):
+        self.check_indexing([(4, 4, 6), (2, 4, 6)], extr.PatchWiseIndexing((2, 2, 2)))
+
+    def test_voxel_wise_indexing(self):
+        self.check_indexing([(2, 3, 2), (3, 2, 2)], extr.VoxelWiseIndexing())
+
+    def test_repeated_slices(self):
+        # repeated slices in a batch are overwritten, i.e. the last sample in the batch has to be kept
+        datasource = _Datasource([(4, 5, 6), (4, 5, 6)], extr.SliceIndexing(1))
+        nb_samples = len(datasource.indices)
+        predictions = self.rng.random((nb_samples, 4, 6, 1))
+        orders = (np.array([0, 1, 1, 2, 0, 3, 4, 5, 6, 7, 8, 9]),
+                  np.array([2, 2, 2, 3, 4, 0, 1, 9, 8, 7, 6, 5]),
+                  np.array([0, 1, 2, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9]))
+        for order in orders:
+            for batch_size in range(1, 9):
+                with self.subTest(order=order, batch_size=batch_size):
+                    self.assert_block_equals_per_sample(datasource, predictions, order, batch_size)
+
+    def test_mixed_subjects_in_batch(self):
+        # adjacent and non-adjacent slices of alternating subjects
+        datasource = _Datasource([(4, 5, 6), (3, 5, 6), (2, 5, 6)], extr.SliceIndexing(0))
+        predictions = self.rng.random((len(datasource.indices), 5, 6, 1))
+        orders = (np.array([0, 4, 1, 5, 2, 6, 3, 7, 8]),
+                  np.array([0, 1, 4, 5, 8, 2, 3, 6, 7]),
+                  np.array([0, 2, 4, 6, 7, 8, 1, 3, 5]))
+        for order in orders:
+            for batch_size in range(1, 9):
+                with self.subTest(order=order, batch_size=batch_size):
+                    self.assert_block_equals_per_sample(datasource, predictions, order, batch_size)
+
+
+class TestApplyTransformInteractionFn(unittest.TestCase):
+
+    def test_transform_not_modified(self):
+        size_correction = tfm.SizeCorrection((6, 6), entries=('a', 'b'))
+        transform = tfm.ComposeTransform([size_correction])
+        interaction_fn = assm.ApplyTransformInteractionFn(transform)
+
+        self.assertTrue(transform.raise_if_missing)
+        self.assertTrue(size_correction.raise_if_missing)
+
+        index_expr = expr.IndexExpression(0)
+        data, ret_index_expr = interaction_fn('a', np.ones((4, 5, 1)), index_expr)
+        self.assertEqual(data.shape, (6, 6, 1))
+        self.assertIs(ret_index_expr, index_expr)
+
+    def test_augmentation_transform(self):
+        transform = tfm.ComposeTransform([augm.RandomMirror(axis=0, entries=('a', 'b'))])
+        interaction_fn = assm.ApplyTransformInteractionFn(transform)
+
+        data = np.arange(4).reshape((4, 1))
+        mirrored, _ = interaction_fn('a', data, expr.IndexExpression(0))
+        np.testing.assert_array_equal(mirrored, data[::-1])
+
+
+class TestSubjectAssemblerRetrieval(unittest.TestCase):
+
+    def setUp(self):
+        # subject 0 has four slices (sample indices 0 to 3), subject 1 three slices (sample indices 4 to 6)
+        self.datasource = _Datasource([(4, 5, 6), (3, 5, 6)], extr.SliceIndexing(0))
+        self.predictions = np.random.default_rng(0).random((len(self.datasource.indices), 5, 6, 1))
+        self.assembler = assm.SubjectAssembler(self.datasource)
+
+    def add_batch(self, sample_indices, last_batch=False):
+        sample_indices = np.array(sample_indices)
+        self.assembler.add_batch(self.predictions[sample_indices], sample_indices, last_batch)
+
+    def test_peek_keeps_subject(self):
+        self.add_batch([0, 1, 2, 3, 4])
+        self.assertEqual(self.assembler.subjects_ready, {0})
+
+        peeked = self.assembler.peek_assembled_subject(0)
+        np.testing.assert_array_equal(peeked, self.predictions[:4])
+        self.assertEqual(self.assembler.subjects_ready, {0})
+        self.assertIs(self.assembler.peek_assembled_subject(0), peeked)
+
+        # peeking a subject that is not ready yet is possible
+        np.testing.assert_array_equal(self.assembler.peek_assembled_subject(1)[0], self.predictions[4])
+
+    def test_release_subject(self):
+        self.add_batch([0, 1, 2, 3, 4])
+        self.assembler.release_subject(0)
+        self.assertEqual(self.assembler.subjects_ready, set())
+        self.assertNotIn(0, self.assembler.predictions)
+        self.assertRaises(ValueError, self.assembler.peek_assembled_subject, 0)
+
+        self.add_batch([5, 6], last_batch=True)
+        self.assertEqual(self.assembler.subjects_ready, {1})
+
+    def test_release_unknown_subject(self):
+        self.assertRaises(ValueError, self.assembler.release_subject, 0)
+
+        self.add_batch([0, 1, 2, 3, 4])
+        self.assertRaises(ValueError, self.assembler.release_subject, 2)
+        self.assembler.release_subject(0)
+        self.assertRaises(ValueError, self.assembler.release_subject, 0)
+        self.assertRaises(ValueError, self.assembler.get_assembled_subject, 0)
+
+    def test_released_subject_reinitialized(self):
+        # released before the subject is complete
+        self.add_batch([0, 1])
+        self.assertEqual(self.assembler.subjects_ready, set())
+        self.assembler.release_subject(0)
+
+        self.add_batch([2, 3])
+        self.assertEqual(self.assembler.subjects_ready, set())  # not ready before the next subject starts
+        subject = self.assembler.peek_assembled_subject(0)
+        np.testing.assert_array_equal(subject[:2], 0)
+        np.testing.assert_array_equal(subject[2:], self.predictions[2:4])
+
+        self.add_batch([4])
+        self.assertEqual(self.assembler.subjects_ready, {0})
+
+    def test_released_subject_receives_samples_again(self):
+        # released after being ready, the samples of the subject are provided again after another subject
+        self.add_batch([0, 1, 2, 3, 4])
+        self.assembler.release_subject(0)
+
+        self.add_batch([5, 6, 0])
+        self.assertEqual(self.assembler.subjects_ready, {1})
+        subject = self.assembler.peek_assembled_subject(0)
+        np.testing.assert_array_equal(subject[0], self.predictions[0])
+        np.testing.assert_array_equal(subject[1:], 0)
+
+        self.assembler.get_assembled_subject(1)
+        self.add_batch([1, 2, 3])
+        self.assertEqual(self.assembler.subjects_ready, set())
+
+        self.assembler.end()
+        self.assertEqual(self.assembler.subjects_ready, {0})
+        np.testing.assert_array_equal(self.assembler.get_assembled_subject(0), self.predictions[:4])
+        self.assertEqual(self.assembler.subjects_ready, set())
+
+
+class TestMeanMergeFn(unittest.TestCase):
+
+    def test_float_dtype_kept(self):
+        for dtype in (np.float16, np.float32, np.float64):
+            with self.subTest(dtype=dtype):
+                planes = [np.full((2, 3, 1), value, dtype=dtype) for value in (1, 2, 4)]
+                merged = assm.mean_merge_fn(planes)
+                self.assertEqual(merged.dtype, dtype)
+                np.testing.assert_allclose(merged, 7 / 3, rtol=1e-3)
+
+    def test_integer_averaged_as_float64(self):
+        # the sum exceeds the uint8 range, thus the planes must not be accumulated in the input type
+        planes = [np.full((2, 3, 1), value, dtype=np.uint8) for value in (200, 255, 100)]
+        merged = assm.mean_merge_fn(planes)
+        self.assertEqual(merged.dtype, np.float64)
+        np.testing.assert_allclose(merged, 185)
+
+    def test_inputs_not_modified(self):
+        planes = [np.full((2, 3, 1), value, dtype=np.float64) for value in (1, 2)]
+        assm.mean_merge_fn(planes)
+        np.testing.assert_array_equal(planes[0], 1)
+        np.testing.assert_array_equal(planes[1], 2)
+
+    def test_memmap_planes(self):
+        planes = [assm.memmap_zeros((2, 3, 1), 'key', 0) for _ in range(2)]
+        planes[1][:] = 2
+        merged = assm.mean_merge_fn(planes)
+        self.assertIs(type(merged), np.ndarray)
+        np.testing.assert_array_equal(merged, 1)
+
+
+class TestZeroFn(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.shapes = [(4, 5, 6), (3, 5, 6)]
+        self.volumes = [rng.random(shape + (2,)) for shape in self.shapes]
+        self.datasource = _Datasource(self.shapes, extr.SliceIndexing(0))
+        self.predictions = _get_predictions(self.datasource, self.volumes)
+
+    def test_memmap_zeros(self):
+        assembled = _assemble(assm.SubjectAssembler(self.datasource, zero_fn=assm.memmap_zeros), self.predictions,
+                              np.arange(len(self.datasource.indices)), 4)
+        for subject_index, volume in enumerate(self.volumes):
+            subject = assembled[subject_index]
+            self.assertIsInstance(subject, np.memmap)
+            np.testing.assert_array_equal(subject, volume)
+
+            # np.asarray keeps the data backed by the file, np.array loads it into memory
+            self.assertTrue(np.shares_memory(np.asarray(subject), subject))
+            in_memory = np.array(subject)
+            self.assertIs(type(in_memory), np.ndarray)
+            self.assertFalse(np.shares_memory(in_memory, subject))
+            np.testing.assert_array_equal(in_memory, volume)
+
+    def test_dtype(self):
+        zero_fn = functools.partial(assm.numpy_zeros, dtype=np.float16)
+        assembled = _assemble(assm.SubjectAssembler(self.datasource, zero_fn=zero_fn), self.predictions,
+                              np.arange(len(self.datasource.indices)), 4)
+        for subject_index, volume in enumerate(self.volumes):
+            self.assertEqual(assembled[subject_index].dtype, np.float16)
+            np.testing.assert_allclose(assembled[subject_index], volume, atol=1e-3)
+
+
+class TestPlaneSubjectAssembler(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.shapes = [(4, 5, 6), (3, 5, 6)]
+        self.volumes = [rng.random(shape + (2,)) for shape in self.shapes]
+
+    def get_padded_predictions(self, datasource):
+        # the slices of all planes are padded to a common shape, which is corrected back when assembling
+        padding = tfm.SizeCorrection((6, 6), entries=('prediction',))
+        return np.stack([padding({'prediction': self.volumes[subject_index][index_expr.expression]})['prediction']
+                         for subject_index, index_expr in datasource.indices])
+
+    def test_padded_predictions(self):
+        datasource = _Datasource(self.shapes, extr.SliceIndexing((0, 1, 2)))
+        predictions = self.get_padded_predictions(datasource)
+
+        for batch_size in (1, 3, 8):
+            with self.subTest(batch_size=batch_size):
+                assembled = _assemble(assm.PlaneSubjectAssembler(datasource), predictions,
+                                      np.arange(len(datasource.indices)), batch_size)
+                self.assertEqual(assembled.keys(), {0, 1})
+                for subject_index, volume in enumerate(self.volumes):
+                    np.testing.assert_allclose(assembled[subject_index], volume)
+
+    def test_dict_predictions(self):
+        datasource = _Datasource(self.shapes, extr.SliceIndexing((0, 1, 2)))
+        predictions = self.get_padded_predictions(datasource)
+        predictions = {'a': predictions, 'b': predictions[..., :1] * 2}
+
+        assembled = _assemble(assm.PlaneSubjectAssembler(datasource), predictions,
+                              np.arange(len(datasource.indices)), 4)
+        self.assertEqual(assembled.keys(), {0, 1})
+        for subject_index, volume in enumerate(self.volumes):
+            self.assertEqual(assembled[subject_index].keys(), {'a', 'b'})
+            np.testing.assert_allclose(assembled[subject_index]['a'], volume)
+            np.testing.assert_allclose(assembled[subject_index]['b'], volume[..., :1] * 2)
+
+    def test_integer_dtype(self):
+        # probabilities scaled to the uint8 range, the planes are merged as float64
+        self.volumes = [np.round(volume * 255) for volume in self.volumes]
+        datasource = _Datasource(self.shapes, extr.SliceIndexing((0, 1, 2)))
+        predictions = self.get_padded_predictions(datasource)
+
+        zero_fn = functools.partial(assm.numpy_zeros, dtype=np.uint8)
+        assembled = _assemble(assm.PlaneSubjectAssembler(datasource, zero_fn=zero_fn), predictions,
+                              np.arange(len(datasource.indices)), 4)
+        for subject_index, volume in enumerate(self.volumes):
+            self.assertEqual(assembled[subject_index].dtype, np.float64)
+            np.testing.assert_array_equal(assembled[subject_index], volume)
+
+    def test_single_plane(self):
+        datasource = _Datasource(self.shapes, extr.SliceIndexing(0))
+        predictions = _get_predictions(datasource, self.volumes)
+
+        assembled = _assemble(assm.PlaneSubjectAssembler(datasource), predictions,
+                              np.arange(len(datasource.indices)), 4)
+        for subject_index, volume in enumerate(self.volumes):
+            np.testing.assert_allclose(assembled[subject_index], volume)
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+import pymia.data.augmentation as augm
+import pymia.data.definition as defs
+import pymia.data.transformation as tfm
+
+
+class TestRaiseIfMissing(unittest.TestCase):
+
+    def setUp(self):
+        self.sample = {defs.KEY_IMAGES: np.random.rand(4, 5, 1)}
+
+    def test_size_correction(self):
+        transform = tfm.SizeCorrection((6, 6), entries=(defs.KEY_IMAGES, defs.KEY_LABELS))
+        self.assertRaises(ValueError, transform, dict(self.sample))
+
+        transform.raise_if_missing = False
+        sample = transform(dict(self.sample))
+        self.assertEqual(sample[defs.KEY_IMAGES].shape, (6, 6, 1))
+        self.assertNotIn(defs.KEY_LABELS, sample)
+
+    def test_loop_entry_transform(self):
+        transform = tfm.Squeeze(entries=(defs.KEY_IMAGES, defs.KEY_LABELS), squeeze_axis=-1)
+        self.assertRaises(ValueError, transform, dict(self.sample))
+
+        transform.raise_if_missing = False
+        sample = transform(dict(self.sample))
+        self.assertEqual(sample[defs.KEY_IMAGES].shape, (4, 5))
+        self.assertNotIn(defs.KEY_LABELS, sample)
+
+    def test_compose_transform(self):
+        transforms = [tfm.SizeCorrection((6, 6), entries=(defs.KEY_IMAGES, defs.KEY_LABELS)),
+                      tfm.Squeeze(entries=(defs.KEY_IMAGES, defs.KEY_LABELS), squeeze_axis=-1)]
+        transform = tfm.ComposeTransform(transforms)
+        self.assertTrue(transform.raise_if_missing)
+        self.assertRaises(ValueError, transform, dict(self.sample))
+
+        transform.raise_if_missing = False
+        self.assertFalse(transform.raise_if_missing)
+        self.assertTrue(all(not t.raise_if_missing for t in transforms))
+        sample = transform(dict(self.sample))
+        self.assertEqual(sample[defs.KEY_IMAGES].shape, (6, 6))
+
+    def test_augmentation_transforms(self):
+        # RandomElasticDeformation relies on np.float, which is not available with recent numpy versions
+        transforms = [augm.RandomCrop((2, 2), entries=(defs.KEY_IMAGES, defs.KEY_LABELS)),
+                      augm.RandomMirror(entries=(defs.KEY_IMAGES, defs.KEY_LABELS)),
+                      augm.RandomRotation90(axes=(0, 1), entries=(defs.KEY_IMAGES, defs.KEY_LABELS)),
+                      augm.RandomShift((0.5,), entries=(defs.KEY_IMAGES, defs.KEY_LABELS))]
+        square_sample = {defs.KEY_IMAGES: np.random.rand(4, 4, 1)}
+        for transform in transforms:
+            with self.subTest(transform=transform.__class__.__name__):
+                self.assertRaises(ValueError, transform, dict(square_sample))
+
+                transform.raise_if_missing = False
+                sample = transform(dict(square_sample))
+                self.assertIn(defs.KEY_IMAGES, sample)
+                self.assertNotIn(defs.KEY_LABELS, sample)
+
+    def test_augmentation_transforms_all_missing(self):
+        transforms = [augm.RandomCrop((2, 2), entries=(defs.KEY_LABELS,)),
+                      augm.RandomElasticDeformation(p=1.0, interpolators=(0,), entries=(defs.KEY_LABELS,)),
+                      augm.RandomShift((0.5,), entries=(defs.KEY_LABELS,))]
+        for transform in transforms:
+            with self.subTest(transform=transform.__class__.__name__):
+                transform.raise_if_missing = False
+                self.assertEqual(transform(dict(self.sample)).keys(), self.sample.keys())
+
+    def test_module_flag_disables_errors(self):
+        transform = tfm.SizeCorrection((6, 6), entries=(defs.KEY_IMAGES, defs.KEY_LABELS))
+        tfm.raise_error_if_entry_not_extracted = False
+        try:
+            sample = transform(dict(self.sample))
+        finally:
+            tfm.raise_error_if_entry_not_extracted = True
+        self.assertEqual(sample[defs.KEY_IMAGES].shape, (6, 6, 1))